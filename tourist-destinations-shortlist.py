@@ -1,123 +1,269 @@
+import asyncio
+import json
 import os
 from dotenv import load_dotenv
-from typing_extensions import TypedDict, Annotated
-from typing import List
-
+from typing import Annotated, List
+import httpx
+import ollama
+from pydantic import BaseModel, Field
+from langchain_community.cache import SQLiteCache
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.globals import set_llm_cache
+from langchain_core.utils.json import parse_partial_json
 from langchain_ollama import ChatOllama
-from langgraph.graph import StateGraph, START, END
-from langgraph.graph.message import add_messages
 from langchain_core.messages import SystemMessage
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 load_dotenv()
 
-# structured data for the two-step process
-class State(TypedDict):
-    """State container for the tourist information agent.
+# Serve repeated prompts from an exact-match cache in a local SQLite file so
+# repeated runs skip the LLM
+set_llm_cache(SQLiteCache(database_path=".langchain.db"))
+
+# With REDIS_URL set, the destinations prompt is matched by embedding
+# similarity instead, so small wording changes still hit the cache. The
+# attraction prompts share one template and differ only in the city names,
+# so they would look like near duplicates of each other and keep exact matching.
+destinations_cache = None
+if os.getenv("REDIS_URL"):
+    from langchain_community.cache import RedisSemanticCache
+    from langchain_ollama import OllamaEmbeddings
     
-    Attributes:
-        messages: Conversation history with proper message handling[citation:2]
-        destinations: List of country-city pairs for iconic tour destinations
-        attractions: Dictionary mapping cities to their famous attractions
-        step: Current step in the process (1 or 2)
-    """
-    messages: Annotated[list, add_messages]
-    destinations: List[str]
-    attractions: dict
-    step: int
+    destinations_cache = RedisSemanticCache(
+        redis_url=os.getenv("REDIS_URL"),
+        embedding=OllamaEmbeddings(model="nomic-embed-text"),
+        score_threshold=0.05,
+    )
+
+# Number of cities sent to the LLM in a single attractions prompt. Every prompt
+# costs a full round trip and prefill, but a batch is only sent once all of its
+# destinations are known, so smaller batches overlap more with Step 1.
+ATTRACTIONS_BATCH_SIZE = int(os.getenv("ATTRACTIONS_BATCH_SIZE", "5"))
+
+# Longest city and attraction names the attractions schema allows
+MAX_CITY_LENGTH = 100
+MAX_ATTRACTION_LENGTH = 80
+
+# Heuristic guard against runaway output (e.g. endless whitespace between JSON
+# elements), in generated tokens per city in a batch. The maxItems/maxLength
+# limits in the schema below are what keep a normal answer short. A typical
+# city takes well under 100 tokens, so this leaves wide headroom. It is not a
+# guarantee: names in non-Latin scripts can take several tokens per character,
+# and an answer cut off by the cap is invalid JSON that fails its batch.
+ATTRACTION_TOKENS_PER_CITY = 600
+
+# Output schemas; the ollama server is constrained to emit JSON matching these
+class Destination(BaseModel):
+    """A single tour destination."""
+    country: str
+    city: str
+
+class DestinationList(BaseModel):
+    """Step 1 output: the iconic tour destinations."""
+    destinations: List[Destination]
+
+class CityAttractions(BaseModel):
+    """Famous attractions of one city."""
+    city: str = Field(max_length=MAX_CITY_LENGTH)
+    # maxItems/maxLength in the schema make ollama stop after 5 short attractions
+    attractions: List[Annotated[str, Field(max_length=MAX_ATTRACTION_LENGTH)]] = Field(max_length=5)
+
+class AttractionsBatch(BaseModel):
+    """Step 2 output: attractions for every city of one batch."""
+    cities: List[CityAttractions] = Field(max_length=ATTRACTIONS_BATCH_SIZE)
 
 # Initialize the Language Model (LLM)
 try:
     # Using gemma3 via ollama - local run - README.md shows the ollama implementation
-    llm = ChatOllama(model="gemma3")
+    # temperature=0 keeps the output deterministic, which is what makes caching it valid
+    # Both models share one pooled set of keep-alive connections to the ollama
+    # server instead of reconnecting per call
+    ollama_settings = {
+        "temperature": 0,
+        "client_kwargs": {"timeout": 60},
+        "async_client_kwargs": {"transport": httpx.AsyncHTTPTransport(
+            retries=2,
+            limits=httpx.Limits(max_keepalive_connections=16, max_connections=32),
+        )},
+    }
+    llm = ChatOllama(model="gemma3", cache=destinations_cache, **ollama_settings)
+    
+    # Listing a city's famous attractions does not need the full model; the
+    # 1b variant reads far fewer weights per token and decodes much faster
+    small_llm = ChatOllama(model="gemma3:1b",
+                           num_predict=ATTRACTION_TOKENS_PER_CITY * ATTRACTIONS_BATCH_SIZE,
+                           **ollama_settings)
 except Exception as e:
     print(f"Error initializing Ollama model: {e}")
-    print("Please ensure Ollama is installed and the 'gemma3' model is available.")
+    print("Please ensure Ollama is installed and the 'gemma3' and 'gemma3:1b' models are available.")
     exit()
 
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Whether a failed ollama request is worth retrying.
+    The ollama client re-raises connection failures as ConnectionError and
+    HTTP error responses as ollama.ResponseError. Of the latter, server errors
+    (e.g. 503 when its request queue is full) are transient, and so are errors
+    sent inside an already started stream (e.g. a crashed or out-of-memory
+    runner), which carry no HTTP status and have status_code -1. Other 4xx
+    responses are request mistakes that would fail again.
+    """
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code >= 500 or error.status_code < 0
+    return isinstance(error, (ConnectionError, TimeoutError, httpx.HTTPError))
+
+async def ainvoke_with_retry(runnable, messages, **kwargs):
+    """
+    Invoke a runnable, retrying transient failures and timeouts (the clients
+    above time out after 60s) with exponential backoff, so one hiccup does
+    not lose a batch. The last error is re-raised once 3 attempts have failed.
+    """
+    async for attempt in AsyncRetrying(retry=retry_if_exception(is_transient_error),
+                                       stop=stop_after_attempt(3),
+                                       wait=wait_exponential_jitter(),
+                                       reraise=True):
+        with attempt:
+            return await runnable.ainvoke(messages, **kwargs)
+
+destinations_llm = llm.with_structured_output(DestinationList)
+attractions_llm = small_llm.with_structured_output(AttractionsBatch)
+
+# Limit how many requests are in flight at once. This should match the number
+# of parallel slots the ollama server was started with (OLLAMA_NUM_PARALLEL).
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+LLM_SLOTS = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+
 # Define the System Prompts
-GET_DESTINATIONS_PROMPT = SystemMessage(content="""You are a travel expert. Generate 10 iconic tour destinations in the format 'country-city' based on the most popular travel destinations from 2017-2024. 
-For example: 'Sri Lanka-Weligama', 'Japan-Tokyo', 'Italy-Rome', 'France-Paris'. 
-Return ONLY a list of 10 country-city pairs, one per line, no additional text.""")
+GET_DESTINATIONS_PROMPT = SystemMessage(content="""You are a travel expert. Generate 10 iconic tour destinations as country and city pairs based on the most popular travel destinations from 2017-2024. 
+For example: Sri Lanka and Weligama, Japan and Tokyo, Italy and Rome, France and Paris.""")
+
+# Plain string template; a SystemMessage is built from it per batch
+GET_ATTRACTIONS_PROMPT_TEMPLATE = """You are a local guide. For each of the cities below, list 5 of the most famous things to watch or visit.
+Cities:
+{cities}"""
 
-GET_ATTRACTIONS_PROMPT_TEMPLATE = SystemMessage(content="""You are a local guide. For the city {city}, list 5 of the most famous things to watch or visit.
-Return ONLY a numbered list of 5 attractions, one per line, no additional text.
-Example format:
-1. Eiffel Tower
-2. Louvre Museum
-3. Notre-Dame Cathedral
-4. Champs-Élysées
-5. Montmartre""")
+# Define the Functions for the Two-Step Process
 
-# Define Node Functions for the Two-Step Process
+class DestinationStream(AsyncCallbackHandler):
+    """
+    Callback that parses the destinations JSON while it is being generated.
+    Each destination is passed to on_destination as soon as the model moves
+    on to the next one.
+    """
+    
+    def __init__(self, on_destination):
+        self.on_destination = on_destination
+        self.reported = 0
+        self.text = ""
+    
+    async def on_chat_model_start(self, serialized, messages, **kwargs):
+        # A retried request generates its output from scratch, and may list
+        # different destinations than the failed attempt did
+        self.text = ""
+        self.reported = 0
+    
+    async def on_llm_new_token(self, token, **kwargs):
+        self.text += token
+        try:
+            parsed = parse_partial_json(self.text)
+        except json.JSONDecodeError:
+            # Cut off somewhere that cannot be completed yet; wait for more
+            return
+        items = parsed.get("destinations", []) if isinstance(parsed, dict) else []
+        
+        # The last item may still be incomplete, so stop short of it
+        for item in items[self.reported:len(items) - 1]:
+            if self.reported >= 10 or not isinstance(item, dict) or not {"country", "city"} <= item.keys():
+                break
+            self.on_destination(f"{item['country']}-{item['city']}")
+            self.reported += 1
 
-def get_destinations_node(state: State) -> dict:
+async def get_destinations(on_destination) -> List[str]:
     """
     Step 1: Get iconic tour destinations country-city wise.
-    This node queries the LLM for 10 iconic destinations.
+    This queries the LLM for 10 iconic destinations. Each one is passed to
+    on_destination as soon as it has been generated, so Step 2 can start
+    while the rest are still being produced.
     """
     print("Step 1: Getting iconic tour destinations...")
     
-    # Query the LLM for destinations
-    response = llm.invoke([GET_DESTINATIONS_PROMPT])
+    # Query the LLM for destinations, reporting them as they stream in
+    stream = DestinationStream(on_destination)
+    response = await ainvoke_with_retry(destinations_llm, [GET_DESTINATIONS_PROMPT],
+                                        config={"callbacks": [stream]})
     
-    # Parse the response to extract destinations
-    destinations_text = response.content.strip()
-    destinations = [line.strip() for line in destinations_text.split('\n') if line.strip()]
+    # Keep the 'country-city' form used throughout the rest of the script
+    destinations = [f"{d.country}-{d.city}" for d in response.destinations]
     
     # Limit to 10 destinations if more were returned
     destinations = destinations[:10]
     
     print(f"Found {len(destinations)} destinations: {destinations}")
     
-    return {
-        "destinations": destinations,
-        "step": 2,  
-        "messages": [response] 
-    }
+    # Report what was not seen while streaming: the last destination, or all
+    # of them when the response came from the cache
+    for destination in destinations[stream.reported:]:
+        on_destination(destination)
+    
+    return destinations
 
-def get_attractions_node(state: State) -> dict:
+async def get_attractions(destinations: List[str]) -> dict:
     """
     Step 2: For each destination, get famous attractions.
-    This processes all destinations from step 1.
+    Called with one batch of up to ATTRACTIONS_BATCH_SIZE destinations, which
+    are all answered by a single structured prompt.
     """
-    print("\nStep 2: Getting famous attractions for each destination...")
-    
     attractions = {}
+    cities = {}
+    
+    for destination in destinations:
+        # Parse country and city from the destination string
+        country, sep, city = destination.partition('-')
+        if not sep:
+            # Fallback if format is different
+            country, city = "Unknown", destination
+        cities[destination] = (country, city)
+    
+    city_names = [city for _, city in cities.values()]
+    print(f"\nStep 2: Getting famous attractions for {', '.join(city_names)}...")
     
-    for destination in state["destinations"]:
+    # Build the prompt listing every city of the batch
+    prompt = SystemMessage(content=GET_ATTRACTIONS_PROMPT_TEMPLATE.format(
+        cities="\n".join(city_names)))
+    
+    # Query the LLM, at most OLLAMA_NUM_PARALLEL batches at a time
+    try:
+        async with LLM_SLOTS:
+            response = await ainvoke_with_retry(attractions_llm, [prompt])
+    except Exception as e:
+        response = e
+    
+    by_city = {} if isinstance(response, Exception) else {
+        item.city.strip().lower(): item.attractions for item in response.cities}
+    
+    # The model may echo a city differently (e.g. 'Tokyo, Japan'). The cities
+    # come back in prompt order, so fall back to their position when the
+    # number of cities matches
+    by_position = []
+    if not isinstance(response, Exception) and len(response.cities) == len(destinations):
+        by_position = [item.attractions for item in response.cities]
+    
+    for index, destination in enumerate(destinations):
+        country, city = cities[destination]
         try:
-            # Parse country and city from the destination string
-            if '-' in destination:
-                country, city = destination.split('-', 1)
-            else:
-                # Fallback if format is different
-                country = "Unknown"
-                city = destination
+            if isinstance(response, Exception):
+                raise response
             
             print(f"\nProcessing {city}, {country}...")
             
-            # Create city-specific prompt
-            attractions_prompt = GET_ATTRACTIONS_PROMPT_TEMPLATE.model_copy()
-            attractions_prompt.content = GET_ATTRACTIONS_PROMPT_TEMPLATE.content.format(city=city)
-            
-            # Query the LLM for attractions
-            response = llm.invoke([attractions_prompt])
-            
-            # Parse the response
-            attractions_text = response.content.strip()
-            attraction_list = [line.strip() for line in attractions_text.split('\n') 
-                             if line.strip() and any(char.isdigit() or char.isalpha() for char in line)]
-            
-            # Clean up the list (remove numbers and dots)
-            clean_attractions = []
-            for item in attraction_list:
-                # Remove leading numbers and punctuation
-                clean_item = item.lstrip('0123456789. ')
-                if clean_item:
-                    clean_attractions.append(clean_item)
+            clean_attractions = by_city.get(city.strip().lower())
+            if clean_attractions is None and by_position:
+                clean_attractions = by_position[index]
+            if clean_attractions is None:
+                raise ValueError(f"no attractions returned for {city}")
             
             # Store attractions for this city
-            attractions[destination] = clean_attractions[:5]  # Limit to 5
+            attractions[destination] = clean_attractions
             
             print(f"  Found {len(clean_attractions)} attractions for {city}")
             
@@ -125,28 +271,26 @@ def get_attractions_node(state: State) -> dict:
             print(f"  Error processing {destination}: {e}")
             attractions[destination] = ["Error retrieving attractions"]
     
-    return {
-        "attractions": attractions,
-        "step": 3,  # Mark process as complete
-        "messages": []  # No additional messages needed
-    }
+    return attractions
 
-def display_results_node(state: State) -> dict:
+def display_results(destinations: List[str], attractions: dict) -> None:
     """
-    Final node: Display all the collected information.
+    Final step: Display all the collected information.
     """
     print("TOURIST INFORMATION AGENT - FINAL RESULTS")
     print("-----------------------------------------")
     
     print("\nICONIC TOUR DESTINATIONS (Country-City):")
-    for i, destination in enumerate(state["destinations"], 1):
+    for i, destination in enumerate(destinations, 1):
         print(f"  {i}. {destination}")
     
     print("\nFAMOUS ATTRACTIONS FOR EACH CITY:")
-    for destination, attraction_list in state["attractions"].items():
-        country_city = destination.split('-')
-        if len(country_city) == 2:
-            country, city = country_city
+    # Only the final destinations; a failed Step 1 attempt may have started
+    # attraction requests for cities that were not in the final list
+    for destination in destinations:
+        attraction_list = attractions.get(destination, [])
+        country, sep, city = destination.partition('-')
+        if sep:
             print(f"\n  {city}, {country}:")
         else:
             print(f"\n  {destination}:")
@@ -157,70 +301,8 @@ def display_results_node(state: State) -> dict:
     print("\n" + "-------------------------------------------------")
     print("Process completed successfully!")
     print("------------------------------------------------")
-    
-    return {"step": 0}  # Reset step for potential reuse
 
-# --- 5. Define Conditional Edge Logic ---
-def route_by_step(state: State) -> str:
-    """
-    Conditional routing based on the current step.
-    This controls the flow through the 2-step process.
-    """
-    step = state.get("step", 1)
-    
-    if step == 1:
-        return "get_destinations"
-    elif step == 2:
-        return "get_attractions"
-    elif step == 3:
-        return "display_results"
-    else:
-        return END
-
-# --- 6. Build the LangGraph Workflow ---
-graph_builder = StateGraph(State)
-
-# Add nodes for each step[citation:5]
-graph_builder.add_node("get_destinations", get_destinations_node)
-graph_builder.add_node("get_attractions", get_attractions_node)
-graph_builder.add_node("display_results", display_results_node)
-
-# Set the entry point
-graph_builder.set_entry_point("get_destinations")
-
-# Add conditional edges to control the flow[citation:1]
-graph_builder.add_conditional_edges(
-    "get_destinations",
-    route_by_step,
-    {
-        "get_attractions": "get_attractions",
-        "display_results": "display_results",
-        END: END
-    }
-)
-
-graph_builder.add_conditional_edges(
-    "get_attractions",
-    route_by_step,
-    {
-        "display_results": "display_results",
-        END: END
-    }
-)
-
-graph_builder.add_edge("display_results", END)
-
-# Compile the graph into an executable workflow[citation:2]
-app = graph_builder.compile()
-
-# # Display the graph structure
-# try:
-#     from IPython.display import Image, display
-#     display(Image(app.get_graph().draw_mermaid_png()))
-# except:
-#     print("Graph visualization requires IPython and graphviz")
-
-# --- 7. Run the Automated Agent ---
+# --- Run the Automated Agent ---
 print("-------------------------------------")
 print("AUTOMATED TOURIST INFORMATION AGENT")
 print("-------------------------------------")
@@ -229,29 +311,41 @@ print("1. Get 10 iconic tour destinations (country-city)")
 print("2. Find famous attractions for each city")
 print("-------------------------------------")
 
-# Initialize the state with step 1
-initial_state = {
-    "messages": [],
-    "destinations": [],
-    "attractions": {},
-    "step": 1
-}
-
-# Run the complete workflow automatically[citation:5]
-try:
+# Run the complete workflow automatically
+async def main():
     print("\nStarting automated process...")
     
-    # Stream through the execution
-    for output in app.stream(initial_state):
-        for node_name, node_output in output.items():
-            if node_name != "__end__":
-                # The nodes already print their progress
-                pass
+    # Start a Step 2 batch as soon as Step 1 has produced enough destinations
+    tasks = []
+    batch = []
+    started = set()
+    
+    def on_destination(destination):
+        # A retried Step 1 reports its destinations again
+        if destination in started:
+            return
+        started.add(destination)
+        batch.append(destination)
+        if len(batch) == ATTRACTIONS_BATCH_SIZE:
+            tasks.append(asyncio.create_task(get_attractions(batch[:])))
+            batch.clear()
+    
+    destinations = await get_destinations(on_destination)
+    if batch:
+        tasks.append(asyncio.create_task(get_attractions(batch)))
+    
+    attractions = {}
+    for batch_attractions in await asyncio.gather(*tasks):
+        attractions.update(batch_attractions)
+    
+    display_results(destinations, attractions)
     
     print("-------------------------------------")
     print("Agent execution completed!")
     print("-------------------------------------")
-    
+
+try:
+    asyncio.run(main())
 except KeyboardInterrupt:
     print("\n\nProcess interrupted by user.")
 except Exception as e: